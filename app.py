@@ -29,6 +29,10 @@ DEFAULT_ZOOM = 8
 def make_graph(segments):
     """Make Plotly Height profile plot"""
     profile = get_height_profile(segments)
+    if len(profile) > 1000:
+        # Downsample long profiles to keep Plotly rendering fast
+        indices = lttb(profile.hor.to_numpy(), profile.vert.to_numpy(), 500)
+        profile = profile.iloc[indices]
     layout = go.Layout(
         height=150,
         xaxis_title="km",
@@ -37,7 +41,7 @@ def make_graph(segments):
     )
 
     fig = go.Figure(layout=layout)
-    fig.add_trace(go.Scatter(x=profile.hor, y=profile.vert, mode="lines"))
+    fig.add_trace(go.Scattergl(x=profile.hor, y=profile.vert, mode="lines"))
 
     return fig
 
@@ -56,10 +60,9 @@ PARAMS["port"] = PARAMS.get("port", 8050)
 
 # Load graph
 G = load_graph()
-locations = [
-    v.get("location") for k, v in G.nodes(data=True) if v.get("location") != None
-]
-locations.sort()
+locations = sorted(nx.get_node_attributes(G, "location").values())
+# Set for O(1) membership tests in the callbacks
+locations_set = frozenset(locations)
 locations_options = [html.Option(value=v) for v in locations]
 
 # Prepare UI
@@ -144,6 +147,7 @@ app.layout = dbc.Container(
                             dl.TileLayer(
                                 attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
                             ),
+                            dl.GeoJSON(id="route-geojson"),
                             dl.LayerGroup(id="layer"),
                         ],
                         style={"width": "100%", "height": "500px"},
@@ -267,13 +271,13 @@ def check_inputs(n_clicks, origin, destination, via):
     if n_clicks is not None:
         if origin == destination:
             return "Origin and destination locations must be different."
-        elif origin not in locations and destination not in locations:
+        elif origin not in locations_set and destination not in locations_set:
             return "Origin and destination locations not found."
-        elif origin not in locations:
+        elif origin not in locations_set:
             return "Origin location not found."
-        elif destination not in locations:
+        elif destination not in locations_set:
             return "Destination location not found."
-        elif via not in locations and not (via == None or via == ""):
+        elif via not in locations_set and not (via == None or via == ""):
             return "Via location not found."
 
 
@@ -281,6 +285,7 @@ def check_inputs(n_clicks, origin, destination, via):
     [
         Output("map", "zoom"),
         Output("map", "center"),
+        Output("route-geojson", "data"),
         Output("layer", "children"),
         Output("distance", "children"),
         Output("distance_unpaved", "children"),
@@ -300,24 +305,21 @@ def update_output(n_clicks, origin, destination, via):
     if n_clicks is not None:
         if (
             origin != destination
-            and origin in locations
-            and destination in locations
-            and (via in locations or (via == None or via == ""))
+            and origin in locations_set
+            and destination in locations_set
+            and (via in locations_set or (via == None or via == ""))
         ):
             if via == None or via == "":
                 via = []
-                file_path = f"./gpx/{origin}-{destination}.gpx".replace(" ", "_")
             else:
-                file_path = f"./gpx/{origin}-{via}-{destination}.gpx".replace(" ", "_")
                 via = [via]
 
             segments = get_path(G, origin, destination, via)
 
-            segments[["geometry"]].to_crs("EPSG:4326").to_file(file_path)
-
-            polylines, markers = get_dl(segments)
+            # Reproject once and reuse for the map and the bounds
+            segments_wgs = segments.to_crs("EPSG:4326")
 
-            geometry = [*polylines, *markers]
+            geojson, markers = get_dl(segments_wgs)
 
             results = (
                 segments[segments.columns[segments.dtypes == "float64"]].sum().round(0)
@@ -331,9 +333,7 @@ def update_output(n_clicks, origin, destination, via):
 
             fig = make_graph(segments)
 
-            centroid = list(
-                box(*segments.to_crs("EPSG:4326").total_bounds).centroid.coords
-            )[0]
+            centroid = list(box(*segments_wgs.total_bounds).centroid.coords)[0]
             centroid = (centroid[1], centroid[0])
 
             # TODO improve
@@ -351,7 +351,8 @@ def update_output(n_clicks, origin, destination, via):
             return (
                 zoom,
                 centroid,
-                geometry,
+                geojson,
+                markers,
                 *results_string,
                 {"display": "block"},
                 fig,
@@ -373,8 +374,15 @@ def download(n_clicks, origin, destination, via):
     if n_clicks is not None:
         if via == None or via == "":
             file_path = f"./gpx/{origin}-{destination}.gpx".replace(" ", "_")
+            via = []
         else:
             file_path = f"./gpx/{origin}-{via}-{destination}.gpx".replace(" ", "_")
+            via = [via]
+
+        if not os.path.exists(file_path):
+            # The route is memoized in get_path, so this returns instantly
+            segments = get_path(G, origin, destination, via)
+            segments[["geometry"]].to_crs("EPSG:4326").to_file(file_path)
 
         return dcc.send_file(file_path)
 
@@ -13,6 +13,7 @@ Create and query the path network
 import os
 
 os.environ["USE_PYGEOS"] = "0"
+import functools
 import pickle
 import geopandas as gpd
 import pandas as pd
@@ -20,40 +21,88 @@ import networkx as nx
 import dash_leaflet as dl
 import momepy
 import numpy as np
-from shapely import ops
-from shapely.geometry import Point, MultiLineString, LineString
+from shapely import force_2d
+from shapely.geometry import Point, LineString
 from shapely.geometry.base import BaseGeometry
 from shapely import wkt
 from pyproj import crs
+from numba import njit, prange
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
 import ast
 
 
-def calc_height_diff(line, start):
-    """Calculate height difference and losses of each segment"""
-
-    height_gain = 0
-    height_loss = 0
-    coords = line.coords
-    for c in range(len(coords) - 1):
-        diff = coords[c + 1][-1] - coords[c][-1]
-        if diff > 0:
-            height_gain += diff
+@njit(cache=True, fastmath=True, parallel=True)
+def _gain_loss(z_concat, starts, ends, flipped):
+    """Accumulate height gains and losses of each segment in parallel
+
+    The z coordinates of all edges are packed in z_concat; each segment
+    spans [starts[i], ends[i]) and flipped marks segments traversed
+    against the packed orientation.
+    """
+    gains = np.zeros(starts.size)
+    losses = np.zeros(starts.size)
+    for i in prange(starts.size):
+        height_gain = 0.0
+        height_loss = 0.0
+        for c in range(starts[i], ends[i] - 1):
+            diff = z_concat[c + 1] - z_concat[c]
+            if diff > 0:
+                height_gain += diff
+            else:
+                height_loss += -diff
+        if flipped[i]:
+            gains[i] = height_loss
+            losses[i] = height_gain
         else:
-            height_loss += -diff
-    return pd.Series([height_gain, height_loss])
+            gains[i] = height_gain
+            losses[i] = height_loss
+    return gains, losses
+
+
+def save_parquet(G):
+    """Save the graph as GeoParquet node and edge tables"""
+    nodes, edges = momepy.nx_to_gdf(G)
+    # momepy does not propagate the graph CRS to the GeoDataFrames
+    nodes = nodes.set_crs(G.graph["crs"])
+    edges = edges.set_crs(G.graph["crs"])
+    nodes.to_parquet("graph_nodes.parquet")
+    edges.to_parquet("graph_edges.parquet")
+
+
+def load_parquet():
+    """Rebuild the graph from GeoParquet node and edge tables"""
+    nodes = gpd.read_parquet("graph_nodes.parquet")
+    edges = gpd.read_parquet("graph_edges.parquet")
+    G = momepy.gdf_to_nx(edges, approach="primal", multigraph=False)
+    G.graph["crs"] = edges.crs
+    locations = {
+        tuple(point.coords[0]): location
+        for point, location in zip(nodes.geometry, nodes["location"])
+        if pd.notna(location)
+    }
+    nx.set_node_attributes(G, locations, "location")
+    return G
 
 
+@functools.lru_cache(maxsize=None)
 def load_graph():
     """Prepare the NetworkX graph or load local file"""
     if os.path.exists("graph.p"):
         with open("graph.p", "rb") as f:
             G = pickle.load(f)
+    elif os.path.exists("graph_nodes.parquet") and os.path.exists(
+        "graph_edges.parquet"
+    ):
+        G = load_parquet()
     elif os.path.exists("graph.gml"):
+        # Legacy format: parsing WKT geometries is slow
         G = nx.read_gml("graph.gml")
         for u, v, data in G.edges(data=True):
             G[u][v]["geometry"] = wkt.loads(G[u][v]["geometry"])
         nx.relabel_nodes(G, {x: ast.literal_eval(x) for x in G.nodes}, False)
         G.graph["crs"] = crs.CRS(G.graph["crs"])
+        save_parquet(G)
     else:
         paths = gpd.read_file("data/veloland.gdb", layer="weg")
 
@@ -92,9 +141,17 @@ def load_graph():
         )
         nx.set_node_attributes(G, closest_locations, "location")
 
+        # Create a dict {location_name: node} for O(1) endpoint lookups
+        G.graph["location_index"] = {
+            name: node for node, name in closest_locations.items()
+        }
+
+        # Freeze the graph: no further structural changes are needed
+        G = nx.freeze(G)
+
         # Save pickle
         with open("graph.p", "wb") as f:
-            pickle.dump(G, f)
+            pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
 
         # Save in GML (Graph Modelling Language)
         def stringify(s):
@@ -109,114 +166,251 @@ def load_graph():
 
         nx.write_gml(G, "graph.gml", stringify)
 
+        # Save in GeoParquet (fast-loading node and edge tables)
+        save_parquet(G)
+
+    # Index graphs saved before the location index was introduced
+    if "location_index" not in G.graph:
+        G.graph["location_index"] = {
+            name: node
+            for node, name in nx.get_node_attributes(G, "location").items()
+        }
+
+    # Precompute both edge orientations so queries never rebuild geometries,
+    # and pack the z coordinates of all edges for the parallel gain/loss kernel
+    z_arrays = []
+    z_offsets = np.zeros(G.number_of_edges() + 1, dtype=np.int64)
+    for e, (u, v, data) in enumerate(G.edges(data=True)):
+        if "geom_reversed" not in data:
+            data["geom_reversed"] = reverse_geom(data["geometry"])
+        data["edge_id"] = e
+        # True while the packed z array matches the geometry orientation
+        data["z_aligned"] = True
+        z = np.asarray(data["geometry"].coords, dtype=np.float32)[:, 2]
+        z_arrays.append(z)
+        z_offsets[e + 1] = z_offsets[e] + z.size
+    G.graph["z_concat"] = np.concatenate(z_arrays)
+    G.graph["z_offsets"] = z_offsets
+
+    # Build a sparse adjacency matrix for SciPy's C implementation of Dijkstra
+    node_id = {node: i for i, node in enumerate(G.nodes)}
+    rows = []
+    cols = []
+    weights = []
+    for u, v, length in G.edges(data="mm_len"):
+        rows += [node_id[u], node_id[v]]
+        cols += [node_id[v], node_id[u]]
+        weights += [length, length]
+    G.graph["node_id"] = node_id
+    G.graph["node_list"] = list(G.nodes)
+    G.graph["csr"] = csr_matrix(
+        (weights, (rows, cols)), shape=(len(node_id), len(node_id))
+    )
+
     return G
 
 
 def reverse_geom(geom):
-    """Reverse Shapely geometry"""
-    # mikewatt CC BY SA 4.0 https://gis.stackexchange.com/a/415879
+    """Reverse a Shapely LineString"""
+    return LineString(np.asarray(geom.coords)[::-1])
 
-    def _reverse(x, y, z=None):
-        if z:
-            return x[::-1], y[::-1], z[::-1]
-        return x[::-1], y[::-1]
 
-    return ops.transform(_reverse, geom)
+# Graph used by the memoized path computation
+_cached_graph = None
 
 
-def get_path(G, origin, destination, via=[]) -> gpd.GeoDataFrame:
-    """Get shortest path using Dijkstra algorithm"""
+@functools.lru_cache(maxsize=512)
+def _get_path_cached(origin, destination, via) -> gpd.GeoDataFrame:
+    """Compute the shortest path on the cached graph"""
 
-    stops = [origin] + via + [destination]
+    G = _cached_graph
+    stops = [origin] + list(via) + [destination]
 
-    segments = []
+    # Build the segment attributes as columns rather than per-edge dicts
+    geometries = []
+    starts = []
+    ends = []
+    legs = []
+    indices = []
+    belags = []
+    edge_ids = []
+    flipped = []
     count = 0
     for s in range(len(stops) - 1):
         start = stops[s]
         end = stops[s + 1]
-        n1 = [x for x in G.nodes if G.nodes[x].get("location") == start][0]
-        n2 = [x for x in G.nodes if G.nodes[x].get("location") == end][0]
-
-        shortest_paths = nx.all_shortest_paths(G, n1, n2, weight="mm_len")
+        n1 = G.graph["location_index"][start]
+        n2 = G.graph["location_index"][end]
+
+        # Run Dijkstra in C on the sparse adjacency matrix
+        node_id = G.graph["node_id"]
+        node_list = G.graph["node_list"]
+        dist, pred = dijkstra(
+            G.graph["csr"], indices=node_id[n1], return_predecessors=True
+        )
+        target = node_id[n2]
+        if np.isinf(dist[target]):
+            raise nx.NetworkXNoPath(f"No path between {start} and {end}.")
 
-        shortest_path = [p for p in shortest_paths][0]
+        # Walk the predecessors back to the source
+        path_ids = [target]
+        while pred[path_ids[-1]] >= 0:
+            path_ids.append(pred[path_ids[-1]])
+        shortest_path = [node_list[i] for i in reversed(path_ids)]
 
-        segment = {}
         for p in range(len(shortest_path) - 1):
-            segment = G[shortest_path[p]][shortest_path[p + 1]]
-            segment["start"] = shortest_path[p]
-            segment["end"] = shortest_path[p + 1]
-            segment["leg"] = s
-            segment["i"] = count
-            segment["is_paved"] = True if segment["BelagTLM"] == "hart" else False
+            u = shortest_path[p]
+            v = shortest_path[p + 1]
+            edge = G[u][v]
 
             # Make sure the direction of the coordinates is correct
-            if segment["geometry"].coords[0] != segment["start"]:
-                segment["geometry"] = reverse_geom(segment["geometry"])
-
-            segments.append(segment)
+            if edge["geometry"].coords[0] != u:
+                edge["geometry"], edge["geom_reversed"] = (
+                    edge["geom_reversed"],
+                    edge["geometry"],
+                )
+                edge["z_aligned"] = not edge["z_aligned"]
+
+            geometries.append(edge["geometry"])
+            starts.append(u)
+            ends.append(v)
+            legs.append(s)
+            indices.append(count)
+            belags.append(edge["BelagTLM"])
+            edge_ids.append(edge["edge_id"])
+            flipped.append(not edge["z_aligned"])
 
             count += 1
 
-    segments = gpd.GeoDataFrame(pd.DataFrame(segments), crs=G.graph["crs"])
-    segments["length_unpaved_km"] = 0.0
-
-    segments["length_km"] = segments.length / 1000
-    segments.loc[~segments.is_paved, "length_unpaved_km"] = (
-        segments.loc[~segments.is_paved].length / 1000
+    # Compute gains and losses of all segments in one parallel dispatch
+    edge_ids = np.array(edge_ids, dtype=np.int64)
+    z_offsets = G.graph["z_offsets"]
+    gains, losses = _gain_loss(
+        G.graph["z_concat"],
+        z_offsets[edge_ids],
+        z_offsets[edge_ids + 1],
+        np.array(flipped, dtype=np.bool_),
     )
-    segments[["height_gain_m", "height_loss_m"]] = segments.apply(
-        lambda x: calc_height_diff(x.geometry, x.start), axis=1
+
+    belags = pd.Series(belags)
+    segments = gpd.GeoDataFrame(
+        {
+            "BelagTLM": belags,
+            "geometry": geometries,
+            "start": starts,
+            "end": ends,
+            "leg": legs,
+            "i": indices,
+            "is_paved": belags == "hart",
+            "height_gain_m": gains,
+            "height_loss_m": losses,
+        },
+        geometry="geometry",
+        crs=G.graph["crs"],
     )
 
+    # Evaluate geometry lengths only once
+    lengths = segments.length.to_numpy()
+    segments["length_km"] = lengths / 1000
+    segments["length_unpaved_km"] = np.where(
+        segments["is_paved"].to_numpy(), 0.0, lengths / 1000
+    )
     return segments
 
 
+def get_path(G, origin, destination, via=[]) -> gpd.GeoDataFrame:
+    """Get shortest path using Dijkstra algorithm"""
+
+    global _cached_graph
+    if G is not _cached_graph:
+        # New graph: previously memoized paths are stale
+        _get_path_cached.cache_clear()
+        _cached_graph = G
+    return _get_path_cached(origin, destination, tuple(via)).copy()
+
+
 def get_dl(segments):
-    """Get Dash leaflet geometry"""
+    """Get Dash leaflet geometry from segments in EPSG:4326"""
 
-    polylines = []
-    stops = []
-    segments = segments.to_crs("EPSG:4326")
     segments = segments.sort_values("i")
-    for s, segment in segments.iterrows():
-        points = []
-        for pt in segment["geometry"].coords:
-            point = (pt[1], pt[0])
-            if point not in points:
-                points.append(point)
-        polylines.append(dl.Polyline(positions=points))
-
-    stops = list(
-        segments.groupby("leg")
-        .first()
-        .apply(lambda x: (x.geometry.coords[0][1], x.geometry.coords[0][0]), axis=1)
-    )
-    stops.append(
-        list(
-            segments.groupby("leg")
-            .last()
-            .apply(
-                lambda x: (x.geometry.coords[-1][1], x.geometry.coords[-1][0]), axis=1
-            )
-        )[-1]
-    )
+
+    # A single 2D feature collection is rendered natively by dash-leaflet
+    geojson = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {},
+                "geometry": force_2d(g).__geo_interface__,
+            }
+            for g in segments.geometry
+        ],
+    }
+
+    legs = segments.groupby("leg", sort=True)
+    stops = [
+        (g.coords[0][1], g.coords[0][0])
+        for g in segments.loc[legs["i"].idxmin()].geometry
+    ]
+    last_geometry = segments.loc[legs["i"].idxmax()].geometry.iloc[-1]
+    stops.append((last_geometry.coords[-1][1], last_geometry.coords[-1][0]))
 
     markers = [dl.Marker(position=x) for x in stops]
 
-    return polylines, markers
+    return geojson, markers
 
 
 def get_height_profile(segments):
     """Get horizontal and vertical distance for plotting"""
-    profile = pd.DataFrame()
-    profile["vert"] = segments.apply(
-        lambda x: np.array(x.geometry.coords)[:, 2].mean(), axis=1
+    means = np.fromiter(
+        (np.asarray(g.coords)[:, 2].mean() for g in segments.geometry),
+        dtype=np.float64,
+        count=len(segments),
+    )
+    profile = pd.DataFrame(
+        {"vert": means, "hor": segments["length_km"].to_numpy().cumsum()}
     )
-    profile["hor"] = segments.length.cumsum() / 1000
     return profile
 
 
+def lttb(x, y, n_out):
+    """Downsample a series with Largest-Triangle-Three-Buckets
+
+    Return the indices of the n_out points that best preserve
+    the visual shape of the series.
+    """
+    n = x.size
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Bucket boundaries between the first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start = edges[i]
+        end = edges[i + 1]
+        next_end = edges[i + 2] if i + 2 <= n_out - 2 else n
+
+        # Average point of the next bucket
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        # Pick the point forming the largest triangle
+        # with the previous pick and the next average
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + areas.argmax()
+        indices[i + 1] = a
+
+    return indices
+
+
 if __name__ == "__main__":
     # Test
     G = load_graph()
@@ -225,4 +419,4 @@ if __name__ == "__main__":
     # via = ["Bern", "Murten", "Romont FR", "Châtel-St-Denis", "Vevey"]
     via = []
     segments = get_path(G, origin, destination, via)
-    points, stops = get_dl(segments)
+    geojson, stops = get_dl(segments.to_crs("EPSG:4326"))